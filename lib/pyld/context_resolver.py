@@ -25,6 +25,8 @@ class ContextResolver:
         """
         # processor-specific RDF parsers
         self.per_op_cache = {}
+        # resolved inline contexts for this operation, keyed by object id
+        self.per_op_objects = {}
         self.shared_cache = shared_cache
         self.document_loader = document_loader
 
@@ -53,10 +55,13 @@ class ContextResolver:
         all_resolved = []
         for ctx in context:
             if isinstance(ctx, str):
-                resolved = self._get(ctx)
+                # remote contexts are cached by absolute URL, so resolve a
+                # relative URL before looking it up
+                url = jsonld.prepend_base(base, ctx)
+                resolved = self._get(url)
                 if not resolved:
                     resolved = self._resolve_remote_context(
-                        active_ctx, ctx, base, cycles)
+                        active_ctx, url, base, cycles)
 
                 # add to output and continue
                 if isinstance(resolved, list):
@@ -71,6 +76,14 @@ class ContextResolver:
                     'jsonld.SyntaxError', {'context': ctx},
                     code='invalid local context')
             else:
+                # the same context object (e.g. a scoped context) is often
+                # resolved many times in one operation; skip canonicalizing
+                # it again (the entry keeps `ctx` alive so its id is stable)
+                entry = self.per_op_objects.get(id(ctx))
+                if entry and entry[0] is ctx:
+                    all_resolved.append(entry[1])
+                    continue
+
                 # context is an object, get/create `ResolvedContext` for it
                 key = canonicalize(dict(ctx)).decode('UTF-8')
                 resolved = self._get(key)
@@ -78,6 +91,7 @@ class ContextResolver:
                     # create a new static `ResolvedContext` and cache it
                     resolved = ResolvedContext(ctx)
                     self._cache_resolved_context(key, resolved, 'static')
+                self.per_op_objects[id(ctx)] = (ctx, resolved)
                 all_resolved.append(resolved)
 
         return all_resolved
@@ -188,28 +202,34 @@ class ContextResolver:
         :param context: the context.
         :param base: the base IRI to use to resolve relative IRIs.
         """
-        if not isinstance(context, dict) and not isinstance(context, frozendict):
-            return
-
-        ctx = context.get('@context')
-
-        if isinstance(ctx, str):
-            context['@context'] = jsonld.prepend_base(base, ctx)
-            return
-
-        if isinstance(ctx, list):
-            for num, element in enumerate(ctx):
-                if isinstance(element, str):
-                    ctx[num] = jsonld.prepend_base(base, element)
-                elif isinstance(element, dict) or isinstance(element, frozendict):
-                    self. _resolve_context_urls({'@context': element}, base)
-            return
-
-        if not isinstance(ctx, dict) and not isinstance(ctx, frozendict):
-            # no @context URLs can be found in non-object
-            return
-
-        # ctx is an object, resolve any context URLs in terms
-        # (Iterate using keys() as items() returns a copy we can't modify)
-        for _, definition in ctx.items():
-            self._resolve_context_urls(definition, base)
+        # contexts still to visit; term definitions and embedded contexts
+        # are pushed here instead of being visited recursively
+        pending = [context]
+        while pending:
+            context = pending.pop()
+            if not isinstance(context, dict) and not isinstance(context, frozendict):
+                continue
+
+            ctx = context.get('@context')
+
+            if isinstance(ctx, str):
+                context['@context'] = jsonld.prepend_base(base, ctx)
+                continue
+
+            if isinstance(ctx, list):
+                for num, element in enumerate(ctx):
+                    if isinstance(element, str):
+                        ctx[num] = jsonld.prepend_base(base, element)
+                    elif isinstance(element, dict) or isinstance(element, frozendict):
+                        pending.append({'@context': element})
+                continue
+
+            if not isinstance(ctx, dict) and not isinstance(ctx, frozendict):
+                # no @context URLs can be found in non-object
+                continue
+
+            # ctx is an object, resolve any context URLs in term definitions
+            # (only objects can hold a scoped @context)
+            for definition in ctx.values():
+                if isinstance(definition, dict) or isinstance(definition, frozendict):
+                    pending.append(definition)
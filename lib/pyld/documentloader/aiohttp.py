@@ -7,10 +7,15 @@ Remote document loader using aiohttp.
 .. moduleauthor:: Olaf Conradi <olaf@conradi.org>
 """
 
+import re
 import string
 import urllib.parse as urllib_parse
 
-from pyld.jsonld import (JsonLdError, parse_link_header, LINK_HEADER_REL)
+from pyld.jsonld import (JsonLdError, parse_link_header, prepend_base,
+                         LINK_HEADER_REL)
+
+# characters allowed in the network location of a URL to load
+_NETLOC_CHARS = frozenset(string.ascii_letters + string.digits + '-.:')
 
 
 def aiohttp_document_loader(loop=None, secure=False, **kwargs):
@@ -41,9 +46,8 @@ def aiohttp_document_loader(loop=None, secure=False, **kwargs):
             # validate URL
             pieces = urllib_parse.urlparse(url)
             if (not all([pieces.scheme, pieces.netloc]) or
-                pieces.scheme not in ['http', 'https'] or
-                set(pieces.netloc) > set(
-                    string.ascii_letters + string.digits + '-.:')):
+                pieces.scheme not in ('http', 'https') or
+                set(pieces.netloc) > _NETLOC_CHARS):
                 raise JsonLdError(
                     'URL could not be dereferenced; '
                     'only "http" and "https" URLs are supported.',
@@ -93,7 +97,7 @@ def aiohttp_document_loader(loop=None, secure=False, **kwargs):
                                 linked_alternate.get('type') == 'application/ld+json' and
                                 not re.match(r'^application\/(\w*\+)?json$', content_type)):
                             doc['contentType'] = 'application/ld+json'
-                            doc['documentUrl'] = jsonld.prepend_base(url, linked_alternate['target'])
+                            doc['documentUrl'] = prepend_base(url, linked_alternate['target'])
 
                     return doc
         except JsonLdError as e:
@@ -9,26 +9,63 @@ Remote document loader using Requests.
 .. moduleauthor:: Tim McNamara <tim.mcnamara@okfn.org>
 .. moduleauthor:: Olaf Conradi <olaf@conradi.org>
 """
+import http.cookiejar
+import re
 import string
+import threading
 import urllib.parse as urllib_parse
 
-from pyld.jsonld import (JsonLdError, parse_link_header, LINK_HEADER_REL)
+from pyld.jsonld import (JsonLdError, parse_link_header, prepend_base,
+                         LINK_HEADER_REL)
 
+# characters allowed in the network location of a URL to load
+_NETLOC_CHARS = frozenset(string.ascii_letters + string.digits + '-.:')
 
-def requests_document_loader(secure=False, **kwargs):
+
+def requests_document_loader(secure=False, session=None, **kwargs):
     """
     Create a Requests document loader.
 
     Can be used to setup extra Requests args such as verify, cert, timeout,
     or others.
 
+    The loader keeps Requests sessions, so connections to a host are kept
+    alive and reused by later loads. A caching session, such as one from
+    requests-cache or CacheControl, may be given to also cache responses
+    according to their HTTP caching headers.
+
+    Thread safety: Requests does not guarantee that a session is safe to
+    share between threads. Without a session argument, the loader may be
+    used from any number of threads, as it creates one session per thread.
+    A given session is used by every thread that calls the loader, so
+    either only call the loader from one thread or pass a session that is
+    safe to share.
+
     :param secure: require all requests to use HTTPS (default: False).
+    :param session: the Requests session to load documents with (default:
+      a new session per thread that does not keep cookies).
     :param **kwargs: extra keyword args for Requests get() call.
 
     :return: the RemoteDocument loader function.
     """
     import requests
 
+    if session is None:
+        # reuse connections between loads, but, as with requests.get(), do
+        # not carry cookies set by one response over to the next request
+        local = threading.local()
+
+        def get_session():
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+                session.cookies.set_policy(
+                    http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            return session
+    else:
+        def get_session():
+            return session
+
     def loader(url, options={}):
         """
         Retrieves JSON-LD at the given URL.
@@ -41,9 +78,8 @@ def requests_document_loader(secure=False, **kwargs):
             # validate URL
             pieces = urllib_parse.urlparse(url)
             if (not all([pieces.scheme, pieces.netloc]) or
-                pieces.scheme not in ['http', 'https'] or
-                set(pieces.netloc) > set(
-                    string.ascii_letters + string.digits + '-.:')):
+                pieces.scheme not in ('http', 'https') or
+                set(pieces.netloc) > _NETLOC_CHARS):
                 raise JsonLdError(
                     'URL could not be dereferenced; only "http" and "https" '
                     'URLs are supported.',
@@ -60,7 +96,7 @@ def requests_document_loader(secure=False, **kwargs):
                 headers = {
                     'Accept': 'application/ld+json, application/json'
                 }
-            response = requests.get(url, headers=headers, **kwargs)
+            response = get_session().get(url, headers=headers, **kwargs)
 
             content_type = response.headers.get('content-type')
             if not content_type:
@@ -92,7 +128,7 @@ def requests_document_loader(secure=False, **kwargs):
                         linked_alternate.get('type') == 'application/ld+json' and
                         not re.match(r'^application\/(\w*\+)?json$', content_type)):
                     doc['contentType'] = 'application/ld+json'
-                    doc['documentUrl'] = jsonld.prepend_base(url, linked_alternate['target'])
+                    doc['documentUrl'] = prepend_base(url, linked_alternate['target'])
             return doc
         except JsonLdError as e:
             raise e
@@ -16,6 +16,7 @@ JSON-LD.
 
 import copy
 import hashlib
+import itertools
 import json
 import re
 import sys
@@ -25,8 +26,8 @@ import uuid
 from .context_resolver import ContextResolver
 from c14n.Canonicalize import canonicalize
 from cachetools import LRUCache
-from collections import namedtuple
-from functools import cmp_to_key
+from collections import deque, namedtuple
+from operator import itemgetter
 import lxml.html
 from numbers import Integral, Real
 from frozendict import frozendict
@@ -52,6 +53,20 @@ XSD_DOUBLE = 'http://www.w3.org/2001/XMLSchema#double'
 XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
 XSD_STRING = 'http://www.w3.org/2001/XMLSchema#string'
 
+# XSD datatypes of the native JSON types, see _native_type
+_NATIVE_TYPES = {
+    bool: XSD_BOOLEAN,
+    float: XSD_DOUBLE,
+    int: XSD_INTEGER,
+    str: XSD_STRING
+}
+
+# types of JSON objects, see _is_object
+_OBJECT_TYPES = (dict, frozendict)
+
+# immutable JSON scalar types, see _clone_json
+_JSON_SCALAR_TYPES = frozenset((str, int, float, bool))
+
 # RDF constants
 RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
 RDF_LIST = RDF + 'List'
@@ -97,8 +112,14 @@ KEYWORDS = [
     '@version',
     '@vocab']
 
+# set of KEYWORDS for constant time membership tests
+_KEYWORD_SET = frozenset(KEYWORDS)
+
 KEYWORD_PATTERN = r'^@[a-zA-Z]+$'
 
+# scheme (or blank node prefix) and colon that start an absolute IRI
+_ABSOLUTE_IRI_RE = re.compile(r'^([A-Za-z][A-Za-z0-9+-.]*|_):[^\s]*$')
+
 # JSON-LD Namespace
 JSON_LD_NS = 'http://www.w3.org/ns/json-ld#'
 
@@ -114,6 +135,24 @@ RESOLVED_CONTEXT_CACHE_MAX_SIZE = 100
 _resolved_context_cache = LRUCache(maxsize=RESOLVED_CONTEXT_CACHE_MAX_SIZE)
 INVERSE_CONTEXT_CACHE_MAX_SIZE = 20
 _inverse_context_cache = LRUCache(maxsize=INVERSE_CONTEXT_CACHE_MAX_SIZE)
+# maximum number of IRIs cached per active context
+IRI_CACHE_MAX_SIZE = 1000
+# compacted IRIs per active context; only vocabulary-relative IRIs (terms,
+# properties and types) are cached, not document IRIs such as @id values.
+# The per-context maps are looked up for nearly every IRI, so they are plain
+# dicts that are emptied once they hold IRI_CACHE_MAX_SIZE entries instead
+# of slower LRUCaches.
+_compact_iri_cache = LRUCache(maxsize=INVERSE_CONTEXT_CACHE_MAX_SIZE)
+# vocabulary-relative expanded IRIs per (frozen) active context; the
+# per-context maps are looked up for nearly every IRI, so they are plain
+# dicts that are emptied once they hold IRI_CACHE_MAX_SIZE entries
+_expand_iri_cache = LRUCache(maxsize=INVERSE_CONTEXT_CACHE_MAX_SIZE)
+# CURIE prefix candidates per active context
+_curie_prefix_cache = LRUCache(maxsize=INVERSE_CONTEXT_CACHE_MAX_SIZE)
+# parsed base IRIs; an operation only uses a handful of bases, so this is a
+# plain dict that is emptied once it holds INVERSE_CONTEXT_CACHE_MAX_SIZE
+# entries
+_parsed_base_cache = {}
 # Initial contexts, defined on first access
 INITIAL_CONTEXTS = {}
 
@@ -461,7 +500,7 @@ def prepend_base(base, iri):
         return iri
 
     # parse IRIs
-    base = parse_url(base)
+    base = _parse_base_url(base)
     rel = parse_url(iri)
 
     # per RFC3986 5.2.2
@@ -531,7 +570,7 @@ def remove_base(base, iri):
     if base is None:
         return iri
 
-    base = parse_url(base)
+    base = _parse_base_url(base)
     rel = parse_url(iri)
 
     # schemes and network locations (authorities) don't match, don't alter IRI
@@ -543,10 +582,13 @@ def remove_base(base, iri):
     base_segments = remove_dot_segments(base.path).split('/')
     iri_segments = remove_dot_segments(rel.path).split('/')
     last = 0 if (rel.fragment or rel.query) else 1
-    while (len(base_segments) and len(iri_segments) > last and
-            base_segments[0] == iri_segments[0]):
-        base_segments.pop(0)
-        iri_segments.pop(0)
+    matched = 0
+    while (matched < len(base_segments) and
+            len(iri_segments) - matched > last and
+            base_segments[matched] == iri_segments[matched]):
+        matched += 1
+    base_segments = base_segments[matched:]
+    iri_segments = iri_segments[matched:]
 
     # use '../' for each non-matching base segment
     rval = ''
@@ -579,10 +621,10 @@ def remove_dot_segments(path):
 
     input = path.split('/')
     output = []
+    last = len(input) - 1
 
-    while len(input) > 0:
-        next = input.pop(0)
-        done = len(input) == 0
+    for i, next in enumerate(input):
+        done = i == last
 
         if next == '.':
             if done:
@@ -627,6 +669,23 @@ def parse_url(url):
     return ParsedUrl(*g)
 
 
+def _parse_base_url(base):
+    """
+    Parses a base IRI, reusing the result of earlier calls with the same
+    base.
+
+    :param base: the base IRI.
+
+    :return: the parsed base IRI.
+    """
+    parsed = _parsed_base_cache.get(base)
+    if parsed is None:
+        if len(_parsed_base_cache) >= INVERSE_CONTEXT_CACHE_MAX_SIZE:
+            _parsed_base_cache.clear()
+        parsed = _parsed_base_cache[base] = parse_url(base)
+    return parsed
+
+
 def unparse_url(parsed):
     if isinstance(parsed, dict):
         parsed = ParsedUrl(**parsed)
@@ -656,6 +715,9 @@ class JsonLdProcessor(object):
         """
         # processor-specific RDF parsers
         self.rdf_parsers = None
+        # the active context uuid and expanded IRI map last used by
+        # _expand_iri, to only consult _expand_iri_cache on context changes
+        self._expand_iri_map = (None, None)
 
     def compact(self, input_, ctx, options):
         """
@@ -748,15 +810,12 @@ class JsonLdProcessor(object):
         if _is_object(ctx) and '@context' in ctx:
             ctx = ctx['@context']
 
-        # build output context
-        ctx = JsonLdProcessor.arrayify(ctx)
-
-        # remove empty contexts
-        tmp = ctx
-        ctx = []
-        for v in tmp:
-            if not _is_object(v) or len(v) > 0:
-                ctx.append(v)
+        # build output context, removing empty contexts
+        # Note: the contexts themselves are not copied, the output shares
+        # them with the ctx argument
+        ctx = [
+            v for v in JsonLdProcessor.arrayify(ctx)
+            if not _is_object(v) or len(v) > 0]
 
         # remove array if only one context
         ctx_length = len(ctx)
@@ -775,11 +834,7 @@ class JsonLdProcessor(object):
             compacted[kwgraph] = graph
         elif _is_object(compacted) and has_context:
             # reorder keys so @context is first
-            graph = compacted
-            compacted = {}
-            compacted['@context'] = ctx
-            for k, v in graph.items():
-                compacted[k] = v
+            compacted = {'@context': ctx, **compacted}
 
         return compacted
 
@@ -842,7 +897,7 @@ class JsonLdProcessor(object):
 
         # build meta-object and retrieve all @context urls
         input_ = {
-            'document': copy.deepcopy(remote_doc['document']),
+            'document': _clone_json(remote_doc['document']),
             'remoteContext': remote_doc['contextUrl']
         }
         if 'expandContext' in options:
@@ -1368,8 +1423,25 @@ class JsonLdProcessor(object):
             if (len(value) == 0 and options['propertyIsArray'] and
                     property not in subject):
                 subject[property] = []
-            for v in value:
-                JsonLdProcessor.add_value(subject, property, v, options)
+            keys = None
+            existing = subject.get(property, [])
+            if not options['allowDuplicate'] and _is_array(existing):
+                keys = [_value_fingerprint(v) for v in value]
+                seen = {_value_fingerprint(v) for v in existing}
+                if None in seen or None in keys:
+                    keys = None
+            if keys is None:
+                for v in value:
+                    JsonLdProcessor.add_value(subject, property, v, options)
+            else:
+                # dedup against the fingerprints of the values seen so far
+                # instead of comparing each value to the whole array
+                add_options = dict(options, allowDuplicate=True)
+                for v, key in zip(value, keys):
+                    if key not in seen:
+                        seen.add(key)
+                        JsonLdProcessor.add_value(
+                            subject, property, v, add_options)
         elif property in subject:
             # check if subject already has value if duplicates not allowed
             has_value = (
@@ -1399,7 +1471,10 @@ class JsonLdProcessor(object):
 
         :return: all of the values for a subject's property as an array.
         """
-        return JsonLdProcessor.arrayify(subject.get(property) or [])
+        value = subject.get(property)
+        if _is_array(value):
+            return value
+        return [] if value is None else [value]
 
     @staticmethod
     def remove_property(subject, property):
@@ -1423,17 +1498,14 @@ class JsonLdProcessor(object):
           [propertyIsArray]: True if the property is always an array,
             False if not (default: False).
         """
-        options.setdefault('propertyIsArray', False)
-
         # filter out value
-        def filter_value(e):
-            return not JsonLdProcessor.compare_values(e, value)
-        values = JsonLdProcessor.get_values(subject, property)
-        values = list(filter(filter_value, values))
+        values = [
+            e for e in JsonLdProcessor.get_values(subject, property)
+            if not JsonLdProcessor.compare_values(e, value)]
 
         if len(values) == 0:
             JsonLdProcessor.remove_property(subject, property)
-        elif len(values) == 1 and not options['propertyIsArray']:
+        elif len(values) == 1 and not options.get('propertyIsArray', False):
             subject[property] = values[0]
         else:
             subject[property] = values
@@ -1455,7 +1527,13 @@ class JsonLdProcessor(object):
         :return: True if v1 and v2 are considered equal, False if not.
         """
         # 1. equal primitives
-        if not _is_object(v1) and not _is_object(v2) and v1 == v2:
+        # Note: a primitive never equals an object, so the object checks
+        # below only run when both values are objects.
+        is_object1 = isinstance(v1, _OBJECT_TYPES)
+        is_object2 = isinstance(v2, _OBJECT_TYPES)
+        if not is_object1 or not is_object2:
+            if is_object1 or is_object2 or v1 != v2:
+                return False
             type1 = type(v1)
             type2 = type(v2)
             if type1 == bool or type2 == bool:
@@ -1463,7 +1541,7 @@ class JsonLdProcessor(object):
             return True
 
         # 2. equal @values
-        if (_is_value(v1) and _is_value(v2) and
+        if ('@value' in v1 and '@value' in v2 and
                 v1['@value'] == v2['@value'] and
                 v1.get('@type') == v2.get('@type') and
                 v1.get('@language') == v2.get('@language') and
@@ -1475,8 +1553,7 @@ class JsonLdProcessor(object):
             return True
 
         # 3. equal @ids
-        if (_is_object(v1) and '@id' in v1 and
-                _is_object(v2) and '@id' in v2):
+        if '@id' in v1 and '@id' in v2:
             return v1['@id'] == v2['@id']
 
         return False
@@ -1500,17 +1577,14 @@ class JsonLdProcessor(object):
         if key is None:
             return rval
 
-        # get default language
-        if type_ == '@language' and type_ in ctx:
-            rval = ctx[type_]
-
-        # get default direction
-        if type_ == '@direction' and type_ in ctx:
-            rval = ctx[type_]
+        # get default language or direction
+        if type_ == '@language' or type_ == '@direction':
+            rval = ctx.get(type_)
 
         # get specific entry information
-        if key in ctx['mappings']:
-            entry = ctx['mappings'][key]
+        mappings = ctx['mappings']
+        if key in mappings:
+            entry = mappings[key]
             if entry is None:
                 return None
 
@@ -1562,6 +1636,8 @@ class JsonLdProcessor(object):
 
         # build RDF dataset
         dataset = {}
+        # keys of the triples already added to each graph
+        unique_triples = {}
 
         # split N-Quad input into lines
         lines = re.split(eoln, input_)
@@ -1623,19 +1699,17 @@ class JsonLdProcessor(object):
             elif match[9] is not None:
                 name = match[9]
 
-            # initialize graph in dataset
-            if name not in dataset:
-                dataset[name] = [triple]
-            # add triple if unique to its graph
-            else:
-                unique = True
-                triples = dataset[name]
-                for t in dataset[name]:
-                    if JsonLdProcessor._compare_rdf_triples(t, triple):
-                        unique = False
-                        break
-                if unique:
-                    triples.append(triple)
+            # add triple if unique to its graph (see _compare_rdf_triples)
+            key = (
+                triple['subject']['type'], triple['subject']['value'],
+                triple['predicate']['value'],
+                triple['object']['type'], triple['object']['value'],
+                triple['object'].get('language'),
+                triple['object'].get('datatype'))
+            seen = unique_triples.setdefault(name, set())
+            if key not in seen:
+                seen.add(key)
+                dataset.setdefault(name, []).append(triple)
 
         return dataset
 
@@ -1997,6 +2071,12 @@ class JsonLdProcessor(object):
                     JsonLdProcessor.add_value(
                         nest_result, item_active_property, [],
                         {'propertyIsArray': True})
+                    continue
+
+                # container mapping and @nest property by compacted
+                # property; the property usually stays the same for every
+                # item
+                term_infos = {}
 
                 # recusively process array values
                 for expanded_item in expanded_value:
@@ -2005,19 +2085,26 @@ class JsonLdProcessor(object):
                         active_ctx, expanded_property, expanded_item,
                         vocab=True, reverse=inside_reverse)
 
+                    term_info = term_infos.get(item_active_property)
+                    if term_info is None:
+                        nest_property = active_ctx['mappings'].get(item_active_property, {}).get('@nest')
+                        if nest_property:
+                            self._check_nest_property(active_ctx, nest_property)
+                        container = JsonLdProcessor.arrayify(
+                            JsonLdProcessor.get_context_value(
+                                active_ctx, item_active_property,
+                                '@container'))
+                        term_info = term_infos[item_active_property] = (
+                            container, nest_property)
+                    container, nest_property = term_info
+
                     # if item_active_property is a @nest property, add values to nestResult, otherwise rval
                     nest_result = rval
-                    nest_property = active_ctx['mappings'].get(item_active_property, {}).get('@nest')
                     if nest_property:
-                        self._check_nest_property(active_ctx, nest_property)
                         if not _is_object(rval.get(nest_property)):
                             rval[nest_property] = {}
                         nest_result = rval[nest_property]
 
-                    container = JsonLdProcessor.arrayify(
-                        JsonLdProcessor.get_context_value(
-                            active_ctx, item_active_property, '@container'))
-
                     # get simple @graph or @list value if appropriate
                     is_graph = _is_graph(expanded_item)
                     is_list = _is_list(expanded_item)
@@ -2228,7 +2315,23 @@ class JsonLdProcessor(object):
                 JsonLdProcessor.get_context_value(
                     active_ctx, active_property, '@container'))
             inside_list = inside_list or '@list' in container
+            drop_scalars = None
             for e in element:
+                if e is None:
+                    continue
+                if type(e) in _JSON_SCALAR_TYPES:
+                    # expand scalars here rather than in a nested call, drop
+                    # free-floating scalars that are not in lists
+                    if drop_scalars is None:
+                        drop_scalars = (not inside_list and (
+                            active_property is None or self._expand_iri(
+                                active_ctx, active_property,
+                                vocab=True) == '@graph'))
+                    if drop_scalars:
+                        continue
+                    rval.append(self._expand_value(
+                        active_ctx, active_property, e, options))
+                    continue
                 # expand element
                 e = self._expand(
                     active_ctx, active_property, e, options,
@@ -2460,13 +2563,13 @@ class JsonLdProcessor(object):
                 active_ctx, key, vocab=True)
 
             # drop non-absolute IRI keys that aren't keywords
-            if (expanded_property is None or
-                not (
-                    _is_absolute_iri(expanded_property) or
-                    _is_keyword(expanded_property))):
+            if expanded_property is None:
+                continue
+            is_keyword = _is_keyword(expanded_property)
+            if not is_keyword and not _is_absolute_iri(expanded_property):
                 continue
 
-            if _is_keyword(expanded_property):
+            if is_keyword:
                 if expanded_active_property == '@reverse':
                     raise JsonLdError(
                         'Invalid JSON-LD syntax; a keyword cannot be used as '
@@ -2851,7 +2954,9 @@ class JsonLdProcessor(object):
             'graphStack': [],
             'subjectStack': [],
             'link': {},
-            'bnodeMap': {}
+            'bnodeMap': {},
+            'typeIndex': {},
+            'frameItems': {}
         }
 
         # produce a map of all graphs and name each bnode
@@ -2887,6 +2992,12 @@ class JsonLdProcessor(object):
         graph_map = {'@default': default_graph}
         referenced_once = {}
 
+        # rdf:type is the only predicate that gets special handling while
+        # reading triples; resolve the options that govern it once
+        rdf_type_to_type = not options.get('useRdfType', False)
+        use_native_types = options['useNativeTypes']
+        rdf_direction = options['rdfDirection']
+
         for name, graph in dataset.items():
             graph_map.setdefault(name, {})
             if name != '@default' and name not in default_graph:
@@ -2906,13 +3017,12 @@ class JsonLdProcessor(object):
                 if object_is_id and o['value'] not in node_map:
                     node_map[o['value']] = {'@id': o['value']}
 
-                if (p == RDF_TYPE and not options.get('useRdfType', False) and
-                        object_is_id):
+                if object_is_id and rdf_type_to_type and p == RDF_TYPE:
                     JsonLdProcessor.add_value(
                         node, '@type', o['value'], {'propertyIsArray': True})
                     continue
 
-                value = self._rdf_to_object(o, options['useNativeTypes'], options['rdfDirection'])
+                value = self._rdf_to_object(o, use_native_types, rdf_direction)
                 JsonLdProcessor.add_value(
                     node, p, value, {'propertyIsArray': True})
 
@@ -3017,7 +3127,7 @@ class JsonLdProcessor(object):
             override_protected=False,
             propagate=True,
             validate_scoped=True,
-            cycles=set()):
+            cycles=None):
         """
         Processes a local context and returns a new active context.
 
@@ -3032,9 +3142,14 @@ class JsonLdProcessor(object):
             (default: True).
         :param validate_scoped: if True, load remote contexts if not already loaded.
             if False, do not load scoped contexts.
+        :param cycles: the scoped context URLs already validated while
+            processing the outermost context (default: a new set).
 
         :return: the new active context.
         """
+        if cycles is None:
+            cycles = set()
+
         has_related = 'related' in active_ctx['mappings']
         # normalize local context to an array
         if _is_object(local_ctx) and _is_array(local_ctx.get('@context')):
@@ -3152,34 +3267,21 @@ class JsonLdProcessor(object):
                         code='invalid remote context')
                 resolved_import = resolved_import[0]
 
-                processed_import = resolved_import.get_processed(active_ctx)
-                if isinstance(processed_import, dict):
-                    # Note: if the same context were used in this active context
-                    # as a reference context, then processed_input might not
-                    # be a dict.
-                    ctx = processed_import
-                else:
-                    import_ctx = resolved_import.document
-                    if '@import' in import_ctx:
-                        raise JsonLdError(
-                            'Invalid JSON-LD syntax; @import must not include @import entry',
-                            'jsonld.SyntaxError', {'context': import_ctx},
-                            code='invalid context entry')
-
-                    # value must be an object with '@context'
-                    # from _find_context_urls
-                    import_ctx.update(ctx)
-                    del import_ctx['@import']
-                    ctx = import_ctx
-                    ctx['_uuid'] = str(uuid.uuid1())
-
-                    # cache processed result (only Python >= 3.6)
-                    # Note: this could potenially conflict if the import
-                    # were used in the same active context as a referenced
-                    # context and an import. In this case, we
-                    # could override the cached result, but seems unlikely.
-                    if sys.version_info[0] > 3 or sys.version_info[1] >= 6:
-                        resolved_import.set_processed(active_ctx, freeze(ctx))
+                import_ctx = resolved_import.document
+                if '@import' in import_ctx:
+                    raise JsonLdError(
+                        'Invalid JSON-LD syntax; @import must not include @import entry',
+                        'jsonld.SyntaxError', {'context': import_ctx},
+                        code='invalid context entry')
+
+                # value must be an object with '@context'
+                # from _find_context_urls
+                # Note: the merge is not cached on the resolved import; it
+                # depends on the importing context, and the imported
+                # document is shared by every context that imports it.
+                ctx = {**import_ctx, **ctx}
+                del ctx['@import']
+                ctx['_uuid'] = str(uuid.uuid1())
 
                 defined['@import'] = True
 
@@ -3520,7 +3622,9 @@ class JsonLdProcessor(object):
                 rval['@direction'] = direction
 
         # do conversion of values that aren't basic JSON types to strings
-        if not (_is_bool(value) or _is_numeric(value) or _is_string(value)):
+        # Note: strings are checked first, _is_numeric has to attempt and
+        # fail a float conversion for them
+        if not (_is_string(value) or _is_bool(value) or _is_numeric(value)):
             value = str(value)
 
         rval['@value'] = value
@@ -3537,43 +3641,57 @@ class JsonLdProcessor(object):
         :return: the array of RDF triples for the given graph.
         """
         triples = []
-        for id_, node in sorted(graph.items()):
-            for property, items in sorted(node.items()):
+        rdf_direction = options.get('rdfDirection')
+        # Note: subjects and properties are visited in sorted order so that
+        # list blank nodes are issued deterministic identifiers. Sorting the
+        # keys alone avoids building and comparing item tuples.
+        for id_ in sorted(graph):
+            # skip relative IRI subjects
+            if not _is_absolute_iri(id_):
+                continue
+            node = graph[id_]
+
+            # RDF subject, shared by every triple about this node
+            subject = {
+                'type': 'blank node' if id_.startswith('_:') else 'IRI',
+                'value': id_
+            }
+
+            for property in sorted(node):
+                items = node[property]
                 if property == '@type':
                     property = RDF_TYPE
                 elif _is_keyword(property):
                     continue
 
-                for item in items:
-                    # skip relative IRI subjects and predicates
-                    if not (_is_absolute_iri(id_) and
-                            _is_absolute_iri(property)):
-                        continue
+                # skip relative IRI predicates
+                if not items or not _is_absolute_iri(property):
+                    continue
 
-                    # RDF subject
-                    subject = {}
-                    if id_.startswith('_:'):
-                        subject['type'] = 'blank node'
-                    else:
-                        subject['type'] = 'IRI'
-                    subject['value'] = id_
-
-                    # RDF predicate
-                    predicate = {}
-                    if property.startswith('_:'):
-                        # skip bnode predicates unless producing
-                        # generalized RDF
-                        if not options['produceGeneralizedRdf']:
-                            continue
-                        predicate['type'] = 'blank node'
-                    else:
-                        predicate['type'] = 'IRI'
-                    predicate['value'] = property
+                # RDF predicate, shared by every triple for this property
+                if property.startswith('_:'):
+                    # skip bnode predicates unless producing
+                    # generalized RDF
+                    if not options['produceGeneralizedRdf']:
+                        continue
+                    predicate = {'type': 'blank node', 'value': property}
+                else:
+                    predicate = {'type': 'IRI', 'value': property}
 
+                # distinct values can map to the same RDF term (e.g. a
+                # native number and its typed string form), so only emit
+                # each object once per subject and predicate
+                seen = set()
+                for item in items:
                     # convert list, value or node object to triple
-                    object = self._object_to_rdf(item, issuer, triples, options.get('rdfDirection'))
+                    object = self._object_to_rdf(item, issuer, triples, rdf_direction)
                     # skip None objects (they are relative IRIs)
                     if object is not None:
+                        key = (object['type'], object['value'],
+                               object.get('datatype'), object.get('language'))
+                        if key in seen:
+                            continue
+                        seen.add(key)
                         triples.append({
                             'subject': subject,
                             'predicate': predicate,
@@ -3647,62 +3765,61 @@ class JsonLdProcessor(object):
 
         :return: the RDF literal or RDF resource.
         """
-        object = {}
-
         if _is_value(item):
-            object['type'] = 'literal'
             value = item['@value']
             datatype = item.get('@type')
+            native_type = _NATIVE_TYPES.get(type(value))
+            if native_type is None:
+                native_type = _native_type(value)
 
             # convert to XSD datatypes as appropriate
-            if item.get('@type') == '@json':
-                object['value'] = canonicalize(value).decode('UTF-8')
-                object['datatype'] = RDF_JSON_LITERAL
-            elif _is_bool(value):
-                object['value'] = 'true' if value else 'false'
-                object['datatype'] = datatype or XSD_BOOLEAN
-            elif _is_double(value) or datatype == XSD_DOUBLE:
+            if datatype == '@json':
+                value = canonicalize(value).decode('UTF-8')
+                datatype = RDF_JSON_LITERAL
+            elif native_type == XSD_BOOLEAN:
+                value = 'true' if value else 'false'
+                datatype = datatype or XSD_BOOLEAN
+            elif (native_type == XSD_DOUBLE or
+                    (native_type == XSD_INTEGER and datatype == XSD_DOUBLE)):
                 # canonical double representation
-                object['value'] = re.sub(
+                value = re.sub(
                     r'(\d)0*E\+?0*(\d)', r'\1E\2',
                     ('%1.15E' % value))
-                object['datatype'] = datatype or XSD_DOUBLE
-            elif _is_integer(value):
-                object['value'] = str(value)
-                object['datatype'] = datatype or XSD_INTEGER
+                datatype = datatype or XSD_DOUBLE
+            elif native_type == XSD_INTEGER:
+                value = str(value)
+                datatype = datatype or XSD_INTEGER
             elif rdfDirection == 'i18n-datatype' and '@direction' in item:
                 datatype = 'https://www.w3.org/ns/i18n#%s_%s' % (
                     item.get('@language', ''),
                     item['@direction']
                 )
-                object['value'] = value
-                object['datatype'] = datatype
             elif '@language' in item:
-                object['value'] = value
-                object['datatype'] = datatype or RDF_LANGSTRING
-                object['language'] = item['@language']
+                return {
+                    'type': 'literal',
+                    'value': value,
+                    'datatype': datatype or RDF_LANGSTRING,
+                    'language': item['@language']
+                }
             else:
-                object['value'] = value
-                object['datatype'] = datatype or XSD_STRING
-        # convert list object to RDF
-        elif _is_list(item):
-            list_ = self._list_to_rdf(item['@list'], issuer, triples, rdfDirection)
-            object['value'] = list_['value']
-            object['type'] = list_['type']
+                datatype = datatype or XSD_STRING
+            return {'type': 'literal', 'value': value, 'datatype': datatype}
+
+        # convert list object to RDF, the list head is a new blank node or
+        # rdf:nil
+        if _is_list(item):
+            return self._list_to_rdf(item['@list'], issuer, triples, rdfDirection)
+
         # convert string/node object to RDF
-        else:
-            id_ = item['@id'] if _is_object(item) else item
-            if id_.startswith('_:'):
-                object['type'] = 'blank node'
-            else:
-                object['type'] = 'IRI'
-            object['value'] = id_
+        id_ = item['@id'] if _is_object(item) else item
+        if id_.startswith('_:'):
+            return {'type': 'blank node', 'value': id_}
 
         # skip relative IRIs
-        if object['type'] == 'IRI' and not _is_absolute_iri(object['value']):
+        if not _is_absolute_iri(id_):
             return None
 
-        return object
+        return {'type': 'IRI', 'value': id_}
 
     def _rdf_to_object(self, o, use_native_types, rdf_direction):
         """
@@ -3744,20 +3861,11 @@ class JsonLdProcessor(object):
 
             # use native types for certain xsd types
             if use_native_types:
-                if type_ == XSD_BOOLEAN:
-                    if rval['@value'] == 'true':
-                        rval['@value'] = True
-                    elif rval['@value'] == 'false':
-                        rval['@value'] = False
-                elif _is_numeric(rval['@value']):
-                    if type_ == XSD_INTEGER:
-                        if rval['@value'].isdigit():
-                            rval['@value'] = int(rval['@value'])
-                    elif type_ == XSD_DOUBLE:
-                        rval['@value'] = float(rval['@value'])
+                parse = _NATIVE_TYPE_PARSERS.get(type_)
+                if parse is not None:
+                    rval['@value'] = parse(rval['@value'])
                 # do not add native type
-                if type_ not in [
-                        XSD_BOOLEAN, XSD_INTEGER, XSD_DOUBLE, XSD_STRING]:
+                elif type_ != XSD_STRING:
                     rval['@type'] = type_
             elif (rdf_direction == 'i18n-datatype' and
                 type_.startswith('https://www.w3.org/ns/i18n#')):
@@ -3775,8 +3883,8 @@ class JsonLdProcessor(object):
             self, input_, graph_map, active_graph, issuer,
             active_subject=None, active_property=None, list_=None):
         """
-        Recursively flattens the subjects in the given JSON-LD expanded
-        input into a node map.
+        Flattens the subjects in the given JSON-LD expanded input into a
+        node map.
 
         :param input_: the JSON-LD expanded input.
         :param graph_map: a map of graph name to subject map.
@@ -3786,133 +3894,189 @@ class JsonLdProcessor(object):
         :param active_property: property within current node.
         :param list_: the list to append to, None for none.
         """
-        # recurse through array
-        if _is_array(input_):
-            for e in input_:
-                self._create_node_map(e, graph_map, active_graph, issuer, active_subject, active_property, list_)
-            return
+        # Note: Instead of recursing, pending work is kept on a stack, so
+        # deeply nested input cannot exhaust the interpreter stack. Entries
+        # are popped in the same order as a depth-first traversal, which
+        # keeps blank node labels and value order unchanged. Entries are:
+        # ('element', input, active graph, active subject, active property,
+        #   list), ('list', list object, subject node, active property,
+        #   list) to add a list once its items are done, and
+        # ('properties', iterator, node, id, input, active graph) for the
+        # remaining properties of a node.
+        stack = [('element', input_, active_graph, active_subject,
+                  active_property, list_)]
+        while stack:
+            entry = stack.pop()
+            kind = entry[0]
+
+            if kind == 'list':
+                _, o, subject_node, active_property, list_ = entry
+                if list_:
+                    list_['@list'].append(o)
+                elif subject_node:
+                    JsonLdProcessor.add_value(
+                        subject_node, active_property, o,
+                        {'propertyIsArray': True, 'allowDuplicate': True})
+                continue
 
-        # Note: At this point, input must be a subject.
+            if kind == 'properties':
+                _, properties, node, id_, input_, active_graph = entry
+                property, objects = next(properties, (None, None))
+                if property is None:
+                    continue
+                # come back for the remaining properties once this one
+                # is done
+                stack.append(entry)
+                self._add_node_map_property(
+                    stack, property, objects, node, id_, input_,
+                    graph_map, active_graph, issuer)
+                continue
 
-        # create new subject or merge into existing one
-        subject_node = graph_map.setdefault(active_graph, {}).get(active_subject) if _is_string(active_subject) else None
+            _, input_, active_graph, active_subject, active_property, list_ = entry
 
-        # spec requires @type to be labeled first, so assign identifiers early
-        if '@type' in input_:
-            for type_ in input_['@type']:
-                if type_.startswith('_:'):
-                    issuer.get_id(type_)
+            # traverse array
+            if _is_array(input_):
+                for e in reversed(input_):
+                    stack.append(('element', e, active_graph, active_subject,
+                                  active_property, list_))
+                continue
 
-        # add values to list
-        if _is_value(input_):
+            # Note: At this point, input must be a subject, a value or a list
+            # object; they are told apart by their keys alone.
+
+            # create new subject or merge into existing one
+            subject_node = graph_map.setdefault(active_graph, {}).get(active_subject) if _is_string(active_subject) else None
+
+            # spec requires @type to be labeled first, so assign identifiers early
             if '@type' in input_:
-                type_ = input_['@type']
-                # relabel @type blank node
-                if type_.startswith('_:'):
-                    type_ = input_['@type'] = issuer.get_id(type_)
-            if list_:
-                list_['@list'].append(input_)
-            elif subject_node:
-                JsonLdProcessor.add_value(
-                    subject_node, active_property, input_,
-                    {'propertyIsArray': True, 'allowDuplicate': False})
-            return
+                for type_ in input_['@type']:
+                    if type_.startswith('_:'):
+                        issuer.get_id(type_)
+
+            # add values to list
+            if '@value' in input_:
+                if '@type' in input_:
+                    type_ = input_['@type']
+                    # relabel @type blank node
+                    if type_.startswith('_:'):
+                        type_ = input_['@type'] = issuer.get_id(type_)
+                if list_:
+                    list_['@list'].append(input_)
+                elif subject_node:
+                    JsonLdProcessor.add_value(
+                        subject_node, active_property, input_,
+                        {'propertyIsArray': True, 'allowDuplicate': False})
+                continue
 
-        if _is_list(input_):
-            o = {'@list': []}
-            self._create_node_map(
-                input_['@list'], graph_map, active_graph, issuer, active_subject, active_property, o)
-            if list_:
-                list_['@list'].append(o)
-            elif subject_node:
-                JsonLdProcessor.add_value(
-                    subject_node, active_property, o,
-                    {'propertyIsArray': True, 'allowDuplicate': True})
-            return
+            if '@list' in input_:
+                o = {'@list': []}
+                stack.append(('list', o, subject_node, active_property, list_))
+                stack.append(('element', input_['@list'], active_graph,
+                              active_subject, active_property, o))
+                continue
 
-        id_ = input_.get('@id')
-        if _is_bnode(input_):
-            id_ = issuer.get_id(id_)
+            id_ = input_.get('@id')
+            if _is_bnode(input_):
+                id_ = issuer.get_id(id_)
 
-        # create new subject or merge into existing one
-        node = graph_map.setdefault(active_graph, {}).setdefault(id_, {'@id': id_})
+            # create new subject or merge into existing one
+            node = graph_map.setdefault(active_graph, {}).setdefault(id_, {'@id': id_})
 
-        if _is_object(active_subject):
-            # reverse property relationship
-            JsonLdProcessor.add_value(
-                node, active_property, active_subject,
-                {'propertyIsArray': True, 'allowDuplicate': False})
-        elif active_property:
-            reference = {'@id': id_}
-            if list_:
-                list_['@list'].append(reference)
-            elif subject_node:
+            if _is_object(active_subject):
+                # reverse property relationship
                 JsonLdProcessor.add_value(
-                    subject_node, active_property, reference,
+                    node, active_property, active_subject,
                     {'propertyIsArray': True, 'allowDuplicate': False})
+            elif active_property:
+                reference = {'@id': id_}
+                if list_:
+                    list_['@list'].append(reference)
+                elif subject_node:
+                    JsonLdProcessor.add_value(
+                        subject_node, active_property, reference,
+                        {'propertyIsArray': True, 'allowDuplicate': False})
 
-        for property, objects in sorted(input_.items()):
-            # skip @id
-            if property == '@id':
-                continue
+            stack.append(('properties', iter(sorted(input_.items())), node,
+                          id_, input_, active_graph))
 
-            # handle reverse properties
-            if property == '@reverse':
-                referenced_node = {'@id': id_}
-                reverse_map = input_['@reverse']
-                for reverse_property, items in reverse_map.items():
-                    for item in items:
-                        self._create_node_map(
-                            item, graph_map, active_graph, issuer,
-                            active_subject=referenced_node,
-                            active_property=reverse_property)
-                continue
+    def _add_node_map_property(
+            self, stack, property, objects, node, id_, input_, graph_map,
+            active_graph, issuer):
+        """
+        Adds a property of a subject to its node in the node map, pushing
+        any nested input onto the given stack of pending node map work.
 
-            # recurse into active_graph
-            if property == '@graph':
-                # add graph subjects map entry
-                graph_map.setdefault(id_, {})
-                g = active_graph if active_graph == '@merged' else id_
-                self._create_node_map(objects, graph_map, g, issuer)
-                continue
+        :param stack: the stack of pending node map work.
+        :param property: the property.
+        :param objects: the values of the property.
+        :param node: the node to add to.
+        :param id_: the @id of the node.
+        :param input_: the JSON-LD expanded subject.
+        :param graph_map: a map of graph name to subject map.
+        :param active_graph: the name of the current graph.
+        :param issuer: the IdentifierIssuer for issuing blank node identifiers.
+        """
+        # skip @id
+        if property == '@id':
+            return
 
-            # recurse into included
-            if property == '@included':
-                self._create_node_map(objects, graph_map, active_graph, issuer)
-                continue
+        # handle reverse properties
+        if property == '@reverse':
+            referenced_node = {'@id': id_}
+            pending = []
+            for reverse_property, items in objects.items():
+                for item in items:
+                    pending.append(('element', item, active_graph,
+                                    referenced_node, reverse_property, None))
+            stack.extend(reversed(pending))
+            return
 
-            # copy non-@type keywords
-            if property != '@type' and _is_keyword(property):
-                if property == '@index' and '@index' in node \
-                    and (input_['@index'] != node['@index'] or
-                         input_['@index']['@id'] != node['@index']['@id']):
-                    raise JsonLdError(
-                        'Invalid JSON-LD syntax; conflicting @index property '
-                        ' detected.', 'jsonld.SyntaxError',
-                        {'node': node}, code='conflicting indexes')
-                node[property] = input_[property]
-                continue
+        # traverse active_graph
+        if property == '@graph':
+            # add graph subjects map entry
+            graph_map.setdefault(id_, {})
+            g = active_graph if active_graph == '@merged' else id_
+            stack.append(('element', objects, g, None, None, None))
+            return
 
-            # if property is a bnode, assign it a new id
-            if property.startswith('_:'):
-                property = issuer.get_id(property)
+        # traverse included
+        if property == '@included':
+            stack.append(('element', objects, active_graph, None, None, None))
+            return
 
-            # ensure property is added for empty arrays
-            if len(objects) == 0:
-                JsonLdProcessor.add_value(
-                    node, property, [], {'propertyIsArray': True})
-                continue
+        # copy non-@type keywords
+        if property != '@type' and _is_keyword(property):
+            if property == '@index' and '@index' in node \
+                and (input_['@index'] != node['@index'] or
+                     input_['@index']['@id'] != node['@index']['@id']):
+                raise JsonLdError(
+                    'Invalid JSON-LD syntax; conflicting @index property '
+                    ' detected.', 'jsonld.SyntaxError',
+                    {'node': node}, code='conflicting indexes')
+            node[property] = input_[property]
+            return
 
-            for o in objects:
-                if property == '@type':
-                    # rename @type blank nodes
-                    o = issuer.get_id(o) if o.startswith('_:') else o
-                    JsonLdProcessor.add_value(
-                        node, property, o,
-                        {'propertyIsArray': True, 'allowDuplicate': False})
-                else:
-                    self._create_node_map(o, graph_map, active_graph, issuer,
-                        active_subject=id_, active_property=property)
+        # if property is a bnode, assign it a new id
+        if property.startswith('_:'):
+            property = issuer.get_id(property)
+
+        # ensure property is added for empty arrays
+        if len(objects) == 0:
+            JsonLdProcessor.add_value(
+                node, property, [], {'propertyIsArray': True})
+            return
+
+        if property == '@type':
+            # rename @type blank nodes
+            JsonLdProcessor.add_value(
+                node, property,
+                [issuer.get_id(o) if o.startswith('_:') else o
+                 for o in objects],
+                {'propertyIsArray': True, 'allowDuplicate': False})
+            return
+
+        for o in reversed(objects):
+            stack.append(('element', o, active_graph, id_, property, None))
 
     def _merge_node_map_graphs(self, graph_map):
         """
@@ -3926,19 +4090,25 @@ class JsonLdProcessor(object):
         merged = {}
         for name, graph in sorted(graph_map.items()):
             for id_, node in sorted(graph.items()):
-                if id_ not in merged:
-                    merged[id_] = {'@id': id}
+                first_seen = id_ not in merged
+                if first_seen:
+                    merged[id_] = {'@id': id_}
                 merged_node = merged[id_]
                 for property, values in sorted(node.items()):
                     if property != '@type' and _is_keyword(property):
                         # copy keywords
                         merged_node[property] = values
-                    else:
+                    elif first_seen:
+                        # values in a node map are already free of
+                        # duplicates, so the first graph a node appears in
+                        # can be copied without comparing values
+                        if values:
+                            merged_node[property] = list(values)
+                    elif values:
                         # merge objects
-                        for value in values:
-                            JsonLdProcessor.add_value(
-                                merged_node, property, value,
-                                {'propertyIsArray': True, 'allowDuplicate': False})
+                        JsonLdProcessor.add_value(
+                            merged_node, property, values,
+                            {'propertyIsArray': True, 'allowDuplicate': False})
         return merged
 
     def _match_frame(self, state, subjects, frame, parent, property):
@@ -3977,8 +4147,10 @@ class JsonLdProcessor(object):
             # when the property is None, which only occurs at the top-level.
             if property is None:
                 state['uniqueEmbeds'] = {state['graph']: {}}
+                state['embedChildren'] = {state['graph']: {}}
             elif not state['graph'] in state['uniqueEmbeds']:
                 state['uniqueEmbeds'][state['graph']] = {}
+                state['embedChildren'][state['graph']] = {}
 
             if flags['embed'] == '@link' and id_ in link:
                 # TODO: may want to also match an existing linked subject
@@ -4041,6 +4213,10 @@ class JsonLdProcessor(object):
                 'parent': parent,
                 'property': property
             }
+            # index embeds by parent @id (parent could be @list)
+            if _is_object(parent) and '@id' in parent:
+                state['embedChildren'][state['graph']].setdefault(
+                    parent['@id'], set()).add(id_)
 
             # push matching subject onto stack to enable circular embed checks
             state['subjectStack'].append({'subject': subject, 'graph': state['graph']})
@@ -4069,6 +4245,9 @@ class JsonLdProcessor(object):
                     {**state, 'embedded': False},
                     subjects, frame['@included'], output, '@included')
 
+            # framing state for embedding the values of this subject
+            embedded_state = {**state, 'embedded': True}
+
             # iterate over subject properties in order
             for prop, objects in sorted(subject.items()):
                 # copy keywords to output
@@ -4088,19 +4267,26 @@ class JsonLdProcessor(object):
                 if flags['explicit'] and prop not in frame:
                     continue
 
+                # frames are only read while matching, so the subframes for
+                # this property are shared by all of its objects
+                if prop in frame:
+                    prop_frame = frame[prop]
+                else:
+                    prop_frame = self._create_implicit_frame(flags)
+                list_frame = None
+
                 # add objects
                 for o in objects:
-                    if prop in frame:
-                        subframe = frame[prop]
-                    else:
-                        subframe = self._create_implicit_frame(flags)
+                    subframe = prop_frame
 
                     # recurse into list
                     if _is_list(o):
-                        if prop in frame and frame[prop][0] and '@list' in frame[prop][0]:
-                            subframe = frame[prop][0]['@list']
-                        else:
-                            subframe = self._create_implicit_frame(flags)
+                        if list_frame is None:
+                            if prop in frame and frame[prop][0] and '@list' in frame[prop][0]:
+                                list_frame = frame[prop][0]['@list']
+                            else:
+                                list_frame = self._create_implicit_frame(flags)
+                        subframe = list_frame
 
                         # add empty list
                         list_ = {'@list': []}
@@ -4111,7 +4297,7 @@ class JsonLdProcessor(object):
                         for o in src:
                             if _is_subject_reference(o):
                                 self._match_frame(
-                                    {**state, 'embedded': True},
+                                    embedded_state,
                                     [o['@id']],
                                     subframe, list_, '@list')
                             else:
@@ -4123,14 +4309,14 @@ class JsonLdProcessor(object):
                     if _is_subject_reference(o):
                         # recurse into subject reference
                         self._match_frame(
-                            {**state, 'embedded': True},
+                            embedded_state,
                             [o['@id']], subframe, output, prop)
                     elif self._value_match(subframe[0], o):
                         # include other values automatically, if they match
                         self._add_frame_output(output, prop, o)
 
             # handle defaults in order
-            for prop in sorted(frame.keys()):
+            for prop, _ in self._sorted_frame_items(state, frame):
                 # skip keywords
                 if prop == '@type':
                     if (not frame[prop] or
@@ -4282,12 +4468,52 @@ class JsonLdProcessor(object):
         :return: all of the matched subjects.
         """
         rval = {}
+        graph = state['graphMap'][state['graph']]
+        candidates = self._type_candidates(state, frame, flags)
         for id_ in subjects:
-            subject = state['graphMap'][state['graph']][id_]
+            if candidates is not None and id_ not in candidates:
+                continue
+            subject = graph[id_]
             if self._filter_subject(state, subject, frame, flags):
                 rval[id_] = subject
         return rval
 
+    def _type_candidates(self, state, frame, flags):
+        """
+        Returns the ids of the subjects in the current graph that have at
+        least one of the specific types in the given frame, or None if the
+        frame may match subjects without such a type.
+
+        Subjects outside of this set can never match the frame, so they
+        can be skipped without running the full frame matching.
+
+        :param state: the current framing state.
+        :param frame: the parsed frame.
+        :param flags: the frame flags.
+
+        :return: the set of candidate ids or None.
+        """
+        types = frame.get('@type')
+        if not types or not all(_is_string(t) for t in types):
+            return None
+        # without requireAll, a frame @id decides the match on its own
+        if '@id' in frame and not flags['requireAll']:
+            return None
+
+        # index the subjects of the current graph by type (once per graph)
+        type_index = state['typeIndex'].get(state['graph'])
+        if type_index is None:
+            type_index = {}
+            for id_, subject in state['graphMap'][state['graph']].items():
+                for type_ in subject.get('@type', []):
+                    type_index.setdefault(type_, set()).add(id_)
+            state['typeIndex'][state['graph']] = type_index
+
+        candidates = set()
+        for type_ in types:
+            candidates.update(type_index.get(type_, ()))
+        return candidates
+
     def _filter_subject(self, state, subject, frame, flags):
         """
         Returns True if the given subject matches the given frame.
@@ -4310,7 +4536,7 @@ class JsonLdProcessor(object):
         # check ducktype
         wildcard = True
         matches_some = False
-        for k, v in sorted(frame.items()):
+        for k, v in self._sorted_frame_items(state, frame):
             match_this = False
             node_values = JsonLdProcessor.get_values(subject, k)
             is_empty = len(v) == 0
@@ -4404,6 +4630,24 @@ class JsonLdProcessor(object):
         # return true if wildcard or subject matches some properties
         return wildcard or matches_some
 
+    def _sorted_frame_items(self, state, frame):
+        """
+        Returns the entries of the given frame sorted by key. Frames are
+        not modified while framing and are matched against many subjects,
+        so the sorted entries are cached in the framing state.
+
+        :param state: the current framing state.
+        :param frame: the frame.
+
+        :return: the sorted (key, value) pairs of the frame.
+        """
+        # the cache entry holds on to the frame so its id stays unique
+        entry = state['frameItems'].get(id(frame))
+        if entry is None or entry[0] is not frame:
+            entry = (frame, sorted(frame.items()))
+            state['frameItems'][id(frame)] = entry
+        return entry[1]
+
     def _remove_embed(self, state, id_):
         """
         Removes an existing embed.
@@ -4436,22 +4680,19 @@ class JsonLdProcessor(object):
                 embed['parent'], property, subject,
                 {'propertyIsArray': use_array})
 
-        # recursively remove dependent dangling embeds
-        def remove_dependents(id_):
-            # get embed keys as a separate array to enable deleting keys
-            # in map
-            try:
-                ids = list(embeds.iterkeys())
-            except AttributeError:
-                ids = list(embeds.keys())
-            for next in ids:
+        # remove dependent dangling embeds, using the parent index to find
+        # the embeds of each removed subject
+        children = state['embedChildren'][state['graph']]
+        queue = deque([id_])
+        while queue:
+            parent_id = queue.popleft()
+            for next in children.pop(parent_id, ()):
+                # the index may be stale if the embed has since moved
                 if (next in embeds and
                         _is_object(embeds[next]['parent']) and
-                        '@id' in embeds[next]['parent'] and # could be @list
-                        embeds[next]['parent']['@id'] == id_):
+                        embeds[next]['parent'].get('@id') == parent_id):
                     del embeds[next]
-                    remove_dependents(next)
-        remove_dependents(id_)
+                    queue.append(next)
 
     def _add_frame_output(self, parent, property, output):
         """
@@ -4522,56 +4763,81 @@ class JsonLdProcessor(object):
 
         :return: the resulting output.
         """
-        # recurse through arrays
-        if _is_array(input_):
-            output = []
-            for e in input_:
-                result = self._cleanup_preserve(e, options)
-                # drop Nones from arrays
-                # XXX needed?
-                if result is not None:
-                    output.append(result)
-            return output
-        elif _is_object(input_):
+        # Note: the output is walked depth-first with an explicit stack of
+        # (parent, key) slots to update, in the same order a recursive walk
+        # would visit them
+        root = [input_]
+        stack = [(root, 0)]
+        arrays = []
+        # ids of the node objects already walked, output framed with
+        # @embed @link may be cyclic and the @id of a bnode is removed before
+        # its properties are walked; the objects stay alive in the output
+        walked = set()
+        while stack:
+            parent, key = stack.pop()
+            value = parent[key]
+
+            # walk arrays, copying them
+            if _is_array(value):
+                output = parent[key] = list(value)
+                arrays.append(output)
+                stack.extend((output, i) for i in reversed(range(len(output))))
+                continue
+
+            if not _is_object(value):
+                continue
+
             # remove @preserve
-            if '@preserve' in input_:
-                #if input_['@preserve'] == '@null':
-                #    return None
-                return input_['@preserve'][0]
+            if '@preserve' in value:
+                #if value['@preserve'] == '@null':
+                #    parent[key] = None
+                parent[key] = value['@preserve'][0]
+                continue
 
             # skip @values
-            if _is_value(input_):
-                return input_
+            if _is_value(value):
+                continue
 
-            # recurse through @lists
-            if _is_list(input_):
-                input_['@list'] = self._cleanup_preserve(
-                    input_['@list'], options)
-                return input_
+            # walk @lists
+            if _is_list(value):
+                stack.append((value, '@list'))
+                continue
 
             # handle in-memory linked nodes
-            if '@id' in input_:
-                id_ = input_['@id']
+            if '@id' in value:
+                id_ = value['@id']
                 if id_ in options['link']:
                     try:
-                        idx = options['link'][id_].index(input_)
+                        idx = options['link'][id_].index(value)
                         # already visited
-                        return options['link'][id_][idx]
+                        parent[key] = options['link'][id_][idx]
+                        continue
                     except:
                         # prevent circular visitation
-                        options['link'][id_].append(input_)
+                        options['link'][id_].append(value)
                 else:
                     # prevent circular visitation
-                    options['link'][id_] = [input_]
+                    options['link'][id_] = [value]
+
+            # prevent circular visitation of nodes without an @id
+            if id(value) in walked:
+                continue
+            walked.add(id(value))
 
             # potentially remove the id, if it is an unreferenced bnode
-            if input_.get('@id') in options['bnodesToClear']:
-                input_.pop('@id')
+            if value.get('@id') in options['bnodesToClear']:
+                value.pop('@id')
 
-            # recurse through properties
-            for prop, v in input_.items():
-                input_[prop] = self._cleanup_preserve(v, options)
-        return input_
+            # walk properties
+            stack.extend((value, prop) for prop in reversed(list(value)))
+
+        # drop Nones from arrays
+        # XXX needed?
+        for output in arrays:
+            if None in output:
+                output[:] = [e for e in output if e is not None]
+
+        return root[0]
 
     def _cleanup_null(self, input_, options):
         """
@@ -4689,6 +4955,49 @@ class JsonLdProcessor(object):
         if iri is None:
             return iri
 
+        # without a value, the result only depends on the active context;
+        # for a value object without @index, it also depends on the value's
+        # type, language, direction and size, and for a subject reference
+        # on whether its @id compacts to a term, which few values differ in;
+        # document IRIs (vocab False) are not cached
+        key = None
+        if vocab and '_uuid' in active_ctx:
+            if value is None:
+                key = (iri, vocab, base, reverse)
+            elif _is_value(value) and '@index' not in value:
+                key = (iri, vocab, base, reverse, len(value),
+                       '@type' in value, value.get('@type'),
+                       '@language' in value, value.get('@language'),
+                       '@direction' in value, value.get('@direction'))
+            elif _is_subject_reference(value):
+                term = self._compact_iri(
+                    active_ctx, value['@id'], None, vocab=True)
+                mapping = active_ctx['mappings'].get(term)
+                key = (iri, vocab, base, reverse, '@id', bool(
+                    term is not None and mapping and
+                    mapping['@id'] == value['@id']))
+        if key is not None:
+            cache = _compact_iri_cache.get(active_ctx['_uuid'])
+            if cache is None:
+                cache = _compact_iri_cache[active_ctx['_uuid']] = {}
+            try:
+                return cache[key]
+            except KeyError:
+                if len(cache) >= IRI_CACHE_MAX_SIZE:
+                    cache.clear()
+                rval = cache[key] = self._compact_iri_uncached(
+                    active_ctx, iri, value, vocab, base, reverse)
+                return rval
+
+        return self._compact_iri_uncached(
+            active_ctx, iri, value, vocab, base, reverse)
+
+    def _compact_iri_uncached(
+            self, active_ctx, iri, value, vocab, base, reverse):
+        """
+        Compacts an IRI or keyword without consulting the compacted IRI
+        cache. See _compact_iri.
+        """
         inverse_context = self._get_inverse_context(active_ctx)
 
         # term is a keyword, force vocab to True
@@ -4700,8 +5009,6 @@ class JsonLdProcessor(object):
 
         # use inverse context to pick a term if iri is relative to vocab
         if vocab and iri in inverse_context:
-            default_language = active_ctx.get('@language', '@none')
-
             # prefer @index if available in value
             containers = []
             if _is_object(value) and '@index' in value and '@graph' not in value:
@@ -4745,15 +5052,15 @@ class JsonLdProcessor(object):
                     type_or_language = '@any'
                     type_or_language_value = '@none'
                 else:
-                    common_language = (
-                            default_language if len(list_) == 0 else None)
+                    common_language = None
                     common_type = None
                     for item in list_:
                         item_language = '@none'
                         item_type = '@none'
-                        if _is_value(item):
+                        item_is_value = _is_value(item)
+                        if item_is_value:
                             if '@direction' in item:
-                                item_language = ('%s_%s' % (item.get('@language', ''), item.get('@direction', '')))
+                                item_language = ('%s_%s' % (item.get('@language', ''), item['@direction']))
                             elif '@language' in item:
                                 item_language = item['@language']
                             elif '@type' in item:
@@ -4766,7 +5073,7 @@ class JsonLdProcessor(object):
                         if common_language is None:
                             common_language = item_language
                         elif (item_language != common_language and
-                                _is_value(item)):
+                                item_is_value):
                             common_language = '@none'
                         if common_type is None:
                             common_type = item_type
@@ -4836,35 +5143,37 @@ class JsonLdProcessor(object):
                         return suffix
 
         # no term or @vocab match, check for possible CURIEs
+        # Note: Only terms whose @id is a proper prefix of iri can form a
+        # CURIE; they are looked up by @id for each candidate prefix length
+        # instead of scanning every term in the context.
         candidate = None
-        for term, definition in active_ctx['mappings'].items():
-            # skip terms with colons, they can't be prefixes
-            if ':' in term:
-                continue
-            # skip entries with @ids that are not partial matches
-            if (definition is None or
-                    not definition['@id'] or
-                    definition['@id'] == iri or
-                    not iri.startswith(definition['@id'])):
+        lengths, prefixes = self._get_curie_prefixes(active_ctx)
+        for length in lengths:
+            if length >= len(iri):
+                break
+            terms = prefixes.get(iri[:length])
+            if terms is None:
                 continue
-
-            # a CURIE is usable if:
-            # 1. it has no mapping, OR
-            # 2. value is None, which means we're not compacting an @value, AND
-            #  the mapping matches the IRI
-            curie = term + ':' + iri[len(definition['@id']):]
-            is_usable_curie = (
-                active_ctx['mappings'][term]['_prefix'] and
-                curie not in active_ctx['mappings'] or
-                (value is None and
-                 active_ctx['mappings'].get(curie, {}).get('@id') == iri))
-
-            # select curie if it is shorter or the same length but
-            # lexicographically less than the current choice
-            if (is_usable_curie and (
-                    candidate is None or
-                    _compare_shortest_least(curie, candidate) < 0)):
-                candidate = curie
+            suffix = iri[length:]
+            for term in terms:
+                # a CURIE is usable if:
+                # 1. it has no mapping, OR
+                # 2. value is None, which means we're not compacting an @value, AND
+                #  the mapping matches the IRI
+                curie = term + ':' + suffix
+                is_usable_curie = (
+                    active_ctx['mappings'][term]['_prefix'] and
+                    curie not in active_ctx['mappings'] or
+                    (value is None and
+                     active_ctx['mappings'].get(curie, {}).get('@id') == iri))
+
+                # select curie if it is shorter or the same length but
+                # lexicographically less than the current choice
+                if (is_usable_curie and (
+                        candidate is None or
+                        _shortest_least_key(curie) <
+                        _shortest_least_key(candidate))):
+                    candidate = curie
 
         # return curie candidate
         if candidate is not None:
@@ -4872,8 +5181,13 @@ class JsonLdProcessor(object):
 
         # if iri could be confused with a compact IRI using a term in this context,
         # signal an error
-        for term, definition in active_ctx['mappings'].items():
-            if definition and definition['_prefix'] and iri.startswith(term + ':'):
+        # Note: prefix terms never contain a colon, so the only term that can
+        # be confused with iri is the part of iri before its first colon
+        colon = iri.find(':')
+        if colon != -1:
+            term = iri[:colon]
+            definition = active_ctx['mappings'].get(term)
+            if definition and definition['_prefix']:
                 raise JsonLdError(
                     'Absolute IRI confused with prefix.',
                     'jsonld.SyntaxError',
@@ -4894,6 +5208,33 @@ class JsonLdProcessor(object):
         # return IRI as is
         return iri
 
+    def _get_curie_prefixes(self, active_ctx):
+        """
+        Gets the terms of the given active context that may be used as the
+        prefix of a CURIE, indexed by their @id, if not already indexed.
+
+        :param active_ctx: the active context to use.
+
+        :return: the sorted distinct lengths of the indexed @ids and the
+          map of @id to the terms defined with it.
+        """
+        rval = _curie_prefix_cache.get(active_ctx['_uuid'])
+        if rval:
+            return rval
+
+        prefixes = {}
+        for term, definition in active_ctx['mappings'].items():
+            # skip terms with colons, they can't be prefixes
+            if ':' in term:
+                continue
+            if definition is None or not definition['@id']:
+                continue
+            prefixes.setdefault(definition['@id'], []).append(term)
+
+        rval = (sorted({len(id_) for id_ in prefixes}), prefixes)
+        _curie_prefix_cache[active_ctx['_uuid']] = rval
+        return rval
+
     def _compact_value(self, active_ctx, active_property, value, options):
         """
         Performs value compaction on an object with @value or @id as the only
@@ -5180,8 +5521,7 @@ class JsonLdProcessor(object):
 
                 # if term has the form of an IRI it must map the same
                 if re.match(r'.*((:[^:])|/)', term):
-                    updated_defined = defined.copy()
-                    updated_defined.update({term: True})
+                    updated_defined = {**defined, term: True}
                     term_iri = self._expand_iri(
                         active_ctx, term, vocab=True,
                         local_ctx=local_ctx, defined=updated_defined)
@@ -5460,8 +5800,37 @@ class JsonLdProcessor(object):
         if value is None or _is_keyword(value) or not _is_string(value):
             return value
 
+        # outside of context processing, a frozen active context can no
+        # longer change, so its vocabulary-relative expansions are cached
+        if vocab and local_ctx is None and type(active_ctx) is frozendict:
+            uuid_, cache = self._expand_iri_map
+            if uuid_ != active_ctx['_uuid']:
+                uuid_ = active_ctx['_uuid']
+                cache = _expand_iri_cache.get(uuid_)
+                if cache is None:
+                    cache = _expand_iri_cache[uuid_] = {}
+                self._expand_iri_map = (uuid_, cache)
+            key = (value, base)
+            try:
+                return cache[key]
+            except KeyError:
+                if len(cache) >= IRI_CACHE_MAX_SIZE:
+                    cache.clear()
+                rval = cache[key] = self._expand_iri_uncached(
+                    active_ctx, value, base, vocab, None, None)
+                return rval
+
+        return self._expand_iri_uncached(
+            active_ctx, value, base, vocab, local_ctx, defined)
+
+    def _expand_iri_uncached(
+            self, active_ctx, value, base, vocab, local_ctx, defined):
+        """
+        Expands a string value to a full IRI without consulting the
+        expanded IRI cache. See _expand_iri.
+        """
         # ignore non-keyword things that look like a keyword
-        if re.match(KEYWORD_PATTERN, value):
+        if value.startswith('@') and re.match(KEYWORD_PATTERN, value):
             return None
 
         # define dependency not if defined
@@ -5477,11 +5846,12 @@ class JsonLdProcessor(object):
             # value is a term
             return mapping['@id']
 
-        colon = str(value).find(':')
+        colon = value.find(':')
 
         # split value into prefix:suffix
         if colon > 0:
-            prefix, suffix = value.split(':', 1)
+            prefix = value[:colon]
+            suffix = value[colon + 1:]
 
             # do not expand blank nodes (prefix of '_') or already-absolute
             # IRIs (suffix of '//')
@@ -5553,7 +5923,7 @@ class JsonLdProcessor(object):
         # shortest and then lexicographically least
         for term, mapping in sorted(
                 active_ctx['mappings'].items(),
-                key=cmp_to_key(_compare_shortest_least)):
+                key=lambda item: _shortest_least_key(item[0])):
             if mapping is None or not mapping.get('@id'):
                 continue
 
@@ -5670,6 +6040,9 @@ class IdentifierIssuer(object):
     previously issued identifiers.
     """
 
+    # issuers are cloned for every permutation tried during normalization
+    __slots__ = ('prefix', 'counter', 'existing', 'order')
+
     def __init__(self, prefix):
         """
         Initializes a new IdentifierIssuer.
@@ -5681,6 +6054,7 @@ class IdentifierIssuer(object):
         self.existing = {}
         self.order = []
 
+    def get_id(self, old=None):
         """
         Gets the new identifier for the given old identifier, where if no old
         identifier is given a new identifier will be generated.
@@ -5689,12 +6063,15 @@ class IdentifierIssuer(object):
 
         :return: the new identifier.
         """
-    def get_id(self, old=None):
         # return existing old identifier
-        if old and old in self.existing:
-            return self.existing[old]
+        if old:
+            id_ = self.existing.get(old)
+            if id_ is not None:
+                return id_
 
         # get next identifier
+        # Note: plain concatenation is faster in CPython than %-formatting
+        # or a cached format string
         id_ = self.prefix + str(self.counter)
         self.counter += 1
 
@@ -5705,6 +6082,18 @@ class IdentifierIssuer(object):
 
         return id_
 
+    def clone(self):
+        """
+        Clones this IdentifierIssuer.
+
+        :return: a copy of this IdentifierIssuer.
+        """
+        issuer = IdentifierIssuer(self.prefix)
+        issuer.counter = self.counter
+        issuer.existing = self.existing.copy()
+        issuer.order = self.order[:]
+        return issuer
+
     def has_id(self, old):
         """
         Returns True if the given old identifier has already been assigned a
@@ -5729,6 +6118,9 @@ class URDNA2015(object):
         self.canonical_issuer = IdentifierIssuer('_:c14n')
         self.quads = []
         self.POSITIONS = {'subject': 's', 'object': 'o', 'name': 'g'}
+        # hashes of Hash Related Blank Node inputs, which repeat across
+        # permutations in Hash N-Degree Quads
+        self.related_hashes = {}
 
     # 4.4) Normalization Algorithm
     def main(self, dataset, options):
@@ -5768,54 +6160,57 @@ class URDNA2015(object):
 
         # 3) Create a list of non-normalized blank node identifiers and
         # populate it using the keys from the blank node to quads map.
-        non_normalized = set(self.blank_node_info.keys())
+        # Note: The blank node to quads map keeps insertion order, so it is
+        # used directly to get a stable iteration order.
+        non_normalized = self.blank_node_info
 
         # 4) Initialize simple, a boolean flag, to true.
-        simple = True
-
         # 5) While simple is true, issue canonical identifiers for blank nodes:
-        while simple:
-            # 5.1) Set simple to false.
-            simple = False
-
-            # 5.2) Clear hash to blank nodes map.
-            self.hash_to_blank_nodes = {}
-
-            # 5.3) For each blank node identifier identifier in non-normalized
-            # identifiers:
-            for id_ in non_normalized:
-                # 5.3.1) Create a hash, hash, according to the Hash First
-                # Degree Quads algorithm.
-                hash = self.hash_first_degree_quads(id_)
-
-                # 5.3.2) Add hash and identifier to hash to blank nodes map,
-                # creating a new entry if necessary.
-                self.hash_to_blank_nodes.setdefault(hash, []).append(id_)
-
-            # 5.4) For each hash to identifier list mapping in hash to blank
-            # nodes map, lexicographically-sorted by hash:
-            for hash, id_list in sorted(self.hash_to_blank_nodes.items()):
-                # 5.4.1) If the length of identifier list is greater than 1,
-                # continue to the next mapping.
-                if len(id_list) > 1:
-                    continue
+        # Note: First degree hashes only depend on the quads that mention a
+        # blank node, never on issued identifiers, so a blank node whose hash
+        # was shared on one pass shares it on every later pass and the loop
+        # can only issue identifiers on its first pass. It is run once.
+
+        # 5.2) Clear hash to blank nodes map.
+        self.hash_to_blank_nodes = {}
 
-                # 5.4.2) Use the Issue Identifier algorithm, passing canonical
-                # issuer and the single blank node identifier in identifier
-                # list, identifier, to issue a canonical replacement identifier
-                # for identifier.
-                # TODO: consider changing `get_id` to `issue`
-                id_ = id_list[0]
-                self.canonical_issuer.get_id(id_)
+        # Note: A single blank node always has a unique hash and gets the
+        # first canonical identifier, so there is no need to hash it.
+        if len(non_normalized) == 1:
+            self.canonical_issuer.get_id(next(iter(non_normalized)))
+            non_normalized = {}
+
+        # 5.3) For each blank node identifier identifier in non-normalized
+        # identifiers:
+        for id_ in non_normalized:
+            # 5.3.1) Create a hash, hash, according to the Hash First
+            # Degree Quads algorithm.
+            hash = self.hash_first_degree_quads(id_)
+
+            # 5.3.2) Add hash and identifier to hash to blank nodes map,
+            # creating a new entry if necessary.
+            self.hash_to_blank_nodes.setdefault(hash, []).append(id_)
+
+        # 5.4) For each hash to identifier list mapping in hash to blank
+        # nodes map, lexicographically-sorted by hash:
+        for hash, id_list in sorted(self.hash_to_blank_nodes.items()):
+            # 5.4.1) If the length of identifier list is greater than 1,
+            # continue to the next mapping.
+            if len(id_list) > 1:
+                continue
 
-                # 5.4.3) Remove identifier from non-normalized identifiers.
-                non_normalized.remove(id_)
+            # 5.4.2) Use the Issue Identifier algorithm, passing canonical
+            # issuer and the single blank node identifier in identifier
+            # list, identifier, to issue a canonical replacement identifier
+            # for identifier.
+            # TODO: consider changing `get_id` to `issue`
+            self.canonical_issuer.get_id(id_list[0])
 
-                # 5.4.4) Remove hash from the hash to blank nodes map.
-                del self.hash_to_blank_nodes[hash]
+            # 5.4.3) Remove identifier from non-normalized identifiers.
+            # Note: Tracked by the canonical issuer.
 
-                # 5.4.5) Set simple to true.
-                simple = True
+            # 5.4.4) Remove hash from the hash to blank nodes map.
+            del self.hash_to_blank_nodes[hash]
 
         # 6) For each hash to identifier list mapping in hash to blank nodes
         # map, lexicographically-sorted by hash:
@@ -5848,8 +6243,7 @@ class URDNA2015(object):
 
             # 6.3) For each result in the hash path list,
             # lexicographically-sorted by the hash in result:
-            cmp_hashes = cmp_to_key(lambda x, y: cmp(x['hash'], y['hash']))
-            for result in sorted(hash_path_list, key=cmp_hashes):
+            for result in sorted(hash_path_list, key=itemgetter('hash')):
                 # 6.3.1) For each blank node identifier, existing identifier,
                 # that was issued a temporary identifier by identifier issuer
                 # in result, issue a canonical identifier, in the same order,
@@ -5868,27 +6262,62 @@ class URDNA2015(object):
         for quad in self.quads:
             # 7.1) Create a copy, quad copy, of quad and replace any existing
             # blank node identifiers using the canonical identifiers previously
-            # issued by canonical issuer. Note: We optimize away the copy here.
+            # issued by canonical issuer. Note: The copy is shallow, only
+            # blank node components are rebuilt, as components may be shared
+            # between quads.
+            quad_copy = {}
             for key, component in quad.items():
-                if key == 'predicate':
-                    continue
-                if(component['type'] == 'blank node' and not
-                    component['value'].startswith(
-                        self.canonical_issuer.prefix)):
-                    component['value'] = self.canonical_issuer.get_id(
-                        component['value'])
+                if key != 'predicate' and component['type'] == 'blank node':
+                    component = {
+                        'type': 'blank node',
+                        'value': self.canonical_issuer.get_id(
+                            component['value'])
+                    }
+                quad_copy[key] = component
 
             # 7.2) Add quad copy to the normalized dataset.
-            normalized.append(JsonLdProcessor.to_nquad(quad))
+            normalized.append((JsonLdProcessor.to_nquad(quad_copy), quad_copy))
 
         # sort normalized output
-        normalized.sort()
+        normalized.sort(key=itemgetter(0))
 
         # 8) Return the normalized dataset.
         if (options.get('format') == 'application/n-quads' or
                 options.get('format') == 'application/nquads'):
-            return ''.join(normalized)
-        return JsonLdProcessor.parse_nquads(''.join(normalized))
+            return ''.join(nquad for nquad, quad in normalized)
+        return self.to_dataset(normalized)
+
+    # helper for building an RDF dataset from sorted, normalized quads
+    def to_dataset(self, normalized):
+        # Note: Equivalent to parsing the joined N-Quads, without serializing
+        # and reparsing them; duplicate quads are adjacent once sorted.
+        dataset = {}
+        last = None
+        for nquad, quad in normalized:
+            if nquad == last:
+                continue
+            last = nquad
+            name = quad['name']['value'] if 'name' in quad else '@default'
+            object = {
+                'type': quad['object']['type'],
+                'value': quad['object']['value']
+            }
+            if object['type'] == 'literal':
+                object['datatype'] = quad['object']['datatype']
+                if quad['object'].get('language'):
+                    object['language'] = quad['object']['language']
+            dataset.setdefault(name, []).append({
+                'subject': {
+                    'type': quad['subject']['type'],
+                    'value': quad['subject']['value']
+                },
+                'predicate': {
+                    'type': quad['predicate']['type'],
+                    'value': quad['predicate']['value']
+                },
+                'object': object
+            })
+        return dataset
 
     # 4.6) Hash First Degree Quads
     def hash_first_degree_quads(self, id_):
@@ -5905,6 +6334,10 @@ class URDNA2015(object):
         # node identifier in the blank node to quads map.
         quads = info['quads']
 
+        # Note: This loop runs for every blank node, bind the helpers locally.
+        to_nquad = JsonLdProcessor.to_nquad
+        modify_component = self.modify_first_degree_component
+
         # 3) For each quad quad in quads:
         for quad in quads:
             # 3.1) Serialize the quad in N-Quads format with the following
@@ -5912,18 +6345,17 @@ class URDNA2015(object):
 
             # 3.1.1) If any component in quad is an blank node, then serialize
             # it using a special identifier as follows:
-            copy = {}
+            quad_copy = {}
             for key, component in quad.items():
-                if key == 'predicate':
-                    copy[key] = component
+                if key == 'predicate' or component['type'] != 'blank node':
+                    quad_copy[key] = component
                     continue
                 # 3.1.2) If the blank node's existing blank node identifier
                 # matches the reference blank node identifier then use the
                 # blank node identifier _:a, otherwise, use the blank node
                 # identifier _:z.
-                copy[key] = self.modify_first_degree_component(
-                    id_, component, key)
-            nquads.append(JsonLdProcessor.to_nquad(copy))
+                quad_copy[key] = modify_component(id_, component, key)
+            nquads.append(to_nquad(quad_copy))
 
         # 4) Sort nquads in lexicographical order.
         nquads.sort()
@@ -5937,7 +6369,7 @@ class URDNA2015(object):
     def modify_first_degree_component(self, id_, component, key):
         if component['type'] != 'blank node':
             return component
-        component = copy.deepcopy(component)
+        component = dict(component)
         component['value'] = '_:a' if component['value'] == id_ else '_:z'
         return component
 
@@ -5947,29 +6379,35 @@ class URDNA2015(object):
         # canonical identifier for related if issued, second the identifier
         # issued by issuer if issued, and last, if necessary, the result of
         # the Hash First Degree Quads algorithm, passing related.
-        if self.canonical_issuer.has_id(related):
-            id_ = self.canonical_issuer.get_id(related)
-        elif issuer.has_id(related):
-            id_ = issuer.get_id(related)
-        else:
-            id_ = self.hash_first_degree_quads(related)
+        # Note: issued identifiers are looked up directly, has_id() followed
+        # by get_id() would look each one up twice.
+        id_ = self.canonical_issuer.existing.get(related)
+        if id_ is None:
+            id_ = issuer.existing.get(related)
+            if id_ is None:
+                id_ = self.hash_first_degree_quads(related)
 
         # 2) Initialize a string input to the value of position.
-        # Note: We use a hash object instead.
-        md = self.create_hash()
-        md.update(position.encode('utf8'))
+        input_ = position
 
         # 3) If position is not g, append <, the value of the predicate in
         # quad, and > to input.
         if position != 'g':
-            md.update(self.get_related_predicate(quad).encode('utf8'))
+            input_ += self.get_related_predicate(quad)
 
         # 4) Append identifier to input.
-        md.update(id_.encode('utf8'))
+        input_ += id_
 
         # 5) Return the hash that results from passing input through the hash
         # algorithm.
-        return md.hexdigest()
+        # Note: The input is short, encoding it once and hashing it in a
+        # single update is cheaper than updating per part. The same inputs
+        # recur for every permutation tried, so their hashes are cached.
+        hash = self.related_hashes.get(input_)
+        if hash is None:
+            hash = self.related_hashes[input_] = self.create_hash(
+                input_.encode('utf8')).hexdigest()
+        return hash
 
     # helper for getting a related predicate
     def get_related_predicate(self, quad):
@@ -5983,14 +6421,14 @@ class URDNA2015(object):
         hash_to_related = self.create_hash_to_related(id_, issuer)
 
         # 4) Create an empty string, data to hash.
-        # Note: We create a hash object instead.
-        md = self.create_hash()
+        # Note: Its parts are collected in a list and hashed once at the end.
+        data_to_hash = []
 
         # 5) For each related hash to blank node list mapping in hash to
         # related blank nodes map, sorted lexicographically by related hash:
         for hash, blank_nodes in sorted(hash_to_related.items()):
             # 5.1) Append the related hash to the data to hash.
-            md.update(hash.encode('utf8'))
+            data_to_hash.append(hash)
 
             # 5.2) Create a string chosen path.
             chosen_path = ''
@@ -5999,9 +6437,24 @@ class URDNA2015(object):
             chosen_issuer = None
 
             # 5.4) For each permutation of blank node list:
-            for permutation in permutations(blank_nodes):
+            # Note: Permutations that share a prefix are generated one after
+            # the other, so once a prefix is skipped in 5.4.4.3 all of the
+            # following permutations that start with it are skipped too.
+            # Note: Reorderings of a blank node that is listed more than once
+            # give identical paths, so only distinct permutations are tried.
+            blank_nodes = sorted(blank_nodes)
+            if len(set(blank_nodes)) == len(blank_nodes):
+                all_permutations = itertools.permutations(blank_nodes)
+            else:
+                all_permutations = _distinct_permutations(blank_nodes)
+            skipped_prefix = None
+            for permutation in all_permutations:
+                if (skipped_prefix is not None and
+                        permutation[:len(skipped_prefix)] == skipped_prefix):
+                    continue
+
                 # 5.4.1) Create a copy of issuer, issuer copy.
-                issuer_copy = copy.deepcopy(issuer)
+                issuer_copy = issuer.clone()
 
                 # 5.4.2) Create a string path.
                 path = ''
@@ -6013,7 +6466,7 @@ class URDNA2015(object):
 
                 # 5.4.4) For each related in permutation:
                 skip_to_next_permutation = False
-                for related in permutation:
+                for index, related in enumerate(permutation):
                     # 5.4.4.1) If a canonical identifier has been issued for
                     # related, append it to path.
                     if(self.canonical_issuer.has_id(related)):
@@ -6038,6 +6491,7 @@ class URDNA2015(object):
                     if(len(chosen_path) != 0 and
                             len(path) >= len(chosen_path) and
                             path > chosen_path):
+                        skipped_prefix = permutation[:index + 1]
                         skip_to_next_permutation = True
                         break
 
@@ -6084,14 +6538,18 @@ class URDNA2015(object):
                     chosen_issuer = issuer_copy
 
             # 5.5) Append chosen path to data to hash.
-            md.update(chosen_path.encode('utf8'))
+            data_to_hash.append(chosen_path)
 
             # 5.6) Replace issuer, by reference, with chosen issuer.
             issuer = chosen_issuer
 
         # 6) Return issuer and the hash that results from passing data to hash
         # through the hash algorithm.
-        return {'hash': md.hexdigest(), 'issuer': issuer}
+        return {
+            'hash': self.create_hash(
+                ''.join(data_to_hash).encode('utf8')).hexdigest(),
+            'issuer': issuer
+        }
 
     # helper for creating hash to related blank nodes map
     def create_hash_to_related(self, id_, issuer):
@@ -6130,16 +6588,19 @@ class URDNA2015(object):
 
         return hash_to_related
 
-    # helper to create appropriate hash object
-    def create_hash(self):
-        return hashlib.sha256()
+    # helper to create appropriate hash object, optionally fed with
+    # initial bytes
+    # Note: The hash algorithm is fixed by the specification, it determines
+    # the canonical identifiers that are issued.
+    def create_hash(self, data=b''):
+        return hashlib.sha256(data)
 
     # helper to hash a list of nquads
     def hash_nquads(self, nquads):
-        md = self.create_hash()
-        for nquad in nquads:
-            md.update(nquad.encode('utf8'))
-        return md.hexdigest()
+        # Note: Joining the nquads and encoding the result once is faster
+        # than encoding each into a shared bytearray or feeding the hash
+        # one nquad at a time; the groups hashed here are small.
+        return self.create_hash(''.join(nquads).encode('utf8')).hexdigest()
 
 
 class URGNA2012(URDNA2015):
@@ -6154,7 +6615,7 @@ class URGNA2012(URDNA2015):
     def modify_first_degree_component(self, id_, component, key):
         if component['type'] != 'blank node':
             return component
-        component = copy.deepcopy(component)
+        component = dict(component)
         if key == 'name':
             component['value'] = '_:g'
         else:
@@ -6208,9 +6669,10 @@ class URGNA2012(URDNA2015):
 
         return hash_to_related
 
-    # helper to create appropriate hash object
-    def create_hash(self):
-        return hashlib.sha1()
+    # helper to create appropriate hash object, optionally fed with
+    # initial bytes
+    def create_hash(self, data=b''):
+        return hashlib.sha1(data)
 
 
 def permutations(elements):
@@ -6219,59 +6681,86 @@ def permutations(elements):
 
     :param elements: the list of elements to permutate.
     """
-    # begin with sorted elements
-    elements.sort()
-    # initialize directional info for permutation algorithm
-    left = {}
-    for v in elements:
-        left[v] = True
+    for permutation in itertools.permutations(sorted(elements)):
+        yield list(permutation)
+
+
+def _distinct_permutations(elements):
+    """
+    Generates the distinct permutations of the given sorted list of
+    elements, which may contain duplicates, in lexicographic order.
 
+    :param elements: the sorted list of elements to permutate.
+    """
+    elements = list(elements)
     length = len(elements)
-    last = length - 1
     while True:
-        yield elements
-
-        # Calculate the next permutation using the Steinhaus-Johnson-Trotter
-        # permutation algorithm.
-
-        # get largest mobile element k
-        # (mobile: element is greater than the one it is looking at)
-        k, pos = None, 0
-        for i in range(length):
-            e = elements[i]
-            is_left = left[e]
-            if((k is None or e > k) and
-                    ((is_left and i > 0 and e > elements[i - 1]) or
-                        (not is_left and i < last and e > elements[i + 1]))):
-                k, pos = e, i
+        yield tuple(elements)
+
+        # find the last position whose element can be increased
+        i = length - 2
+        while i >= 0 and elements[i] >= elements[i + 1]:
+            i -= 1
 
         # no more permutations
-        if k is None:
+        if i < 0:
             return
 
-        # swap k and the element it is looking at
-        swap = pos - 1 if left[k] else pos + 1
-        elements[pos], elements[swap] = elements[swap], k
+        # swap it with the last larger element and reverse the suffix
+        j = length - 1
+        while elements[j] <= elements[i]:
+            j -= 1
+        elements[i], elements[j] = elements[j], elements[i]
+        elements[i + 1:] = reversed(elements[i + 1:])
+
+
+def _shortest_least_key(s):
+    """
+    Returns a sort key that orders strings first by length and then
+    lexicographically.
+
+    :param s: the string.
 
-        # reverse the direction of all elements larger than k
-        for i in range(length):
-            if elements[i] > k:
-                left[elements[i]] = not left[elements[i]]
+    :return: the sort key.
+    """
+    return len(s), s
 
 
-def _compare_shortest_least(a, b):
+def _value_fingerprint(v):
     """
-    Compares two strings first based on length and then lexicographically.
+    Returns a hashable key for a JSON-LD value such that two values have
+    equal keys exactly when JsonLdProcessor.compare_values() considers them
+    equal. Values that are never equal to anything (including themselves)
+    get a unique key.
 
-    :param a: the first string.
-    :param b: the second string.
+    :param v: the value.
 
-    :return: -1 if a < b, 1 if a > b, 0 if a == b.
+    :return: the key, or None if the value has no key and must be compared
+      with compare_values().
     """
-    rval = cmp(len(a), len(b))
-    if rval == 0:
-        rval = cmp(a, b)
-    return rval
+    if isinstance(v, _OBJECT_TYPES):
+        if '@value' in v:
+            if '@id' in v:
+                return None
+            val = v['@value']
+            key = ('@value', type(val) is bool, val, v.get('@type'),
+                   v.get('@language'), v.get('@index'))
+        elif '@id' in v:
+            val = None
+            key = ('@id', v['@id'])
+        else:
+            return object()
+    else:
+        val = v
+        key = ('', type(v) is bool, v)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    # NaN never equals itself
+    if val != val:
+        return object()
+    return key
 
 
 def _is_keyword(v):
@@ -6282,9 +6771,7 @@ def _is_keyword(v):
 
     :return: True if the value is a keyword, False if not.
     """
-    if not _is_string(v):
-        return False
-    return v in KEYWORDS
+    return isinstance(v, str) and v in _KEYWORD_SET
 
 
 def _is_object(v):
@@ -6295,7 +6782,7 @@ def _is_object(v):
 
     :return: True if the value is an Object, False if not.
     """
-    return isinstance(v, dict) or isinstance(v, frozendict)
+    return isinstance(v, _OBJECT_TYPES)
 
 
 def _is_empty_object(v):
@@ -6376,7 +6863,9 @@ def _is_integer(v):
 
     :return: True if the value is an Integer, False if not.
     """
-    return isinstance(v, Integral)
+    # Integral is an ABC, checking against it is much slower than the type
+    # test for plain ints
+    return type(v) is int or isinstance(v, Integral)
 
 
 def _is_double(v):
@@ -6387,7 +6876,27 @@ def _is_double(v):
 
     :return: True if the value is a Double, False if not.
     """
-    return not isinstance(v, Integral) and isinstance(v, Real)
+    return type(v) is float or (
+        not isinstance(v, Integral) and isinstance(v, Real))
+
+
+def _native_type(v):
+    """
+    Returns the XSD datatype for a native JSON value: XSD_BOOLEAN,
+    XSD_DOUBLE or XSD_INTEGER for booleans and numbers, XSD_STRING for
+    anything else.
+
+    :param v: the value to check.
+
+    :return: the XSD datatype IRI.
+    """
+    if _is_bool(v):
+        return XSD_BOOLEAN
+    if _is_double(v):
+        return XSD_DOUBLE
+    if _is_integer(v):
+        return XSD_INTEGER
+    return XSD_STRING
 
 
 def _is_numeric(v):
@@ -6405,6 +6914,51 @@ def _is_numeric(v):
         return False
 
 
+def _native_boolean(v):
+    """
+    Converts an xsd:boolean lexical value to a native boolean.
+
+    :param v: the lexical value.
+
+    :return: True or False, or v if it is not 'true' or 'false'.
+    """
+    if v == 'true':
+        return True
+    if v == 'false':
+        return False
+    return v
+
+
+def _native_integer(v):
+    """
+    Converts an xsd:integer lexical value to a native integer.
+
+    :param v: the lexical value.
+
+    :return: the integer, or v if it is not a string of digits.
+    """
+    return int(v) if _is_numeric(v) and v.isdigit() else v
+
+
+def _native_double(v):
+    """
+    Converts an xsd:double lexical value to a native float.
+
+    :param v: the lexical value.
+
+    :return: the float, or v if it is not numeric.
+    """
+    return float(v) if _is_numeric(v) else v
+
+
+# converters from lexical values to native types by XSD datatype
+_NATIVE_TYPE_PARSERS = {
+    XSD_BOOLEAN: _native_boolean,
+    XSD_INTEGER: _native_integer,
+    XSD_DOUBLE: _native_double,
+}
+
+
 def _is_subject(v):
     """
     Returns True if the given value is a subject with properties.
@@ -6418,7 +6972,7 @@ def _is_subject(v):
     # 2. It is not a @value, @set, or @list.
     # 3. It has more than 1 key OR any existing key is not @id.
     rval = False
-    if (_is_object(v) and
+    if (isinstance(v, _OBJECT_TYPES) and
             '@value' not in v and '@set' not in v and '@list' not in v):
         rval = len(v) > 1 or '@id' not in v
     return rval
@@ -6435,7 +6989,7 @@ def _is_subject_reference(v):
     # Note: A value is a subject reference if all of these hold True:
     # 1. It is an Object.
     # 2. It has a single key: @id.
-    return (_is_object(v) and len(v) == 1 and '@id' in v)
+    return (isinstance(v, _OBJECT_TYPES) and len(v) == 1 and '@id' in v)
 
 
 def _is_value(v):
@@ -6449,7 +7003,7 @@ def _is_value(v):
     # Note: A value is a @value if all of these hold True:
     # 1. It is an Object.
     # 2. It has the @value property.
-    return _is_object(v) and '@value' in v
+    return isinstance(v, _OBJECT_TYPES) and '@value' in v
 
 
 def _is_list(v):
@@ -6463,7 +7017,7 @@ def _is_list(v):
     # Note: A value is a @list if all of these hold True:
     # 1. It is an Object.
     # 2. It has the @list property.
-    return _is_object(v) and '@list' in v
+    return isinstance(v, _OBJECT_TYPES) and '@list' in v
 
 
 def _is_graph(v):
@@ -6477,8 +7031,8 @@ def _is_graph(v):
 
     :return: True if the value is a graph object
     """
-    return (_is_object(v) and '@graph' in v and
-        len([k for k, vv in v.items() if (k != '@id' and k != '@index')]) == 1)
+    return (isinstance(v, _OBJECT_TYPES) and '@graph' in v and
+        len(v) - ('@id' in v) - ('@index' in v) == 1)
 
 
 def _is_simple_graph(v):
@@ -6505,7 +7059,7 @@ def _is_bnode(v):
     # 2. If it has an @id key its value begins with '_:'.
     # 3. It has no keys OR is not a @value, @set, or @list.
     rval = False
-    if _is_object(v):
+    if isinstance(v, _OBJECT_TYPES):
         if '@id' in v:
             rval = str(v['@id']).startswith('_:')
         else:
@@ -6523,7 +7077,8 @@ def _is_absolute_iri(v):
 
     :return: True if the value is an absolute IRI, False if not.
     """
-    return _is_string(v) and re.match(r'^([A-Za-z][A-Za-z0-9+-.]*|_):[^\s]*$', v)
+    # most relative IRIs and terms have no colon at all
+    return _is_string(v) and ':' in v and _ABSOLUTE_IRI_RE.match(v)
 
 
 def _is_relative_iri(v):
@@ -6537,9 +7092,29 @@ def _is_relative_iri(v):
     """
     return _is_string(v)
 
+def _clone_json(value):
+    """
+    Returns a deep copy of the given JSON value. Dicts and lists are copied,
+    immutable scalars are shared and anything else is copied with
+    copy.deepcopy().
+
+    :param value: the value to copy.
+
+    :return: the copy.
+    """
+    type_ = type(value)
+    if type_ is dict:
+        return {k: _clone_json(v) for k, v in value.items()}
+    if type_ is list:
+        return [_clone_json(v) for v in value]
+    if type_ in _JSON_SCALAR_TYPES or value is None:
+        return value
+    return copy.deepcopy(value)
+
+
 def freeze(value):
     if isinstance(value, dict):
-        return frozendict(dict([(k, v) for (k, v) in value.items()]))
+        return frozendict(value)
     return value
 
 # The default JSON-LD document loader.